@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration for the Puch AI MCP server.
+
+Run with:
+  gunicorn -c gunicorn_conf.py -k uvicorn.workers.UvicornWorker main:app
+
+Each worker is a separate process with its own copy of the in-memory
+document store in tools/document.py, so an upload handled by one worker is
+not visible to the others. Set REDIS_URL to share sessions across workers;
+without it every worker still works standalone.
+"""
+
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8086")
+
+# Process-level parallelism so CPU-bound text extraction on one request
+# does not block unrelated MCP calls
+workers = int(os.environ.get("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Every worker owns a PDF extraction process pool; the workers already spread
+# requests across cores, so one pool process each avoids oversubscribing them
+os.environ.setdefault("PDF_POOL_WORKERS", "1")
+worker_connections = 1000
+keepalive = 5
@@ -2,7 +2,15 @@
 ASGI entrypoint for the Puch AI MCP server.
 
 Run with:
-  uvicorn main:app --host 0.0.0.0 --port 8086
+  uvicorn main:app --http httptools --loop uvloop --host 0.0.0.0 --port 8086
+or simply:
+  python main.py
+
+Install uvicorn[standard] so uvloop and httptools are available; plain
+`uvicorn main:app` also picks them up automatically when importable.
+
+For multiple worker processes run under Gunicorn:
+  gunicorn -c gunicorn_conf.py -k uvicorn.workers.UvicornWorker main:app
 
 Exposes MCP over Streamable HTTP at /mcp/ path.
 """
@@ -12,10 +20,13 @@ from __future__ import annotations
 import os
 import sys
 from pathlib import Path
+from typing import Final
 
 from dotenv import load_dotenv
 from fastmcp import FastMCP
 from fastmcp.server.auth import StaticTokenVerifier
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
 
 # Load environment variables from .env
 load_dotenv()
@@ -46,11 +57,8 @@ if str(PROJECT_ROOT) not in sys.path:
 from tools import validate as validate_tool
 from tools import document as document_tool
 
-# Add comprehensive tool listing with fallback information
-@mcp.tool()
-def list_available_tools() -> str:
-    """List all available document processing tools with fallback options"""
-    return """🛠️ **Available Document Processing Tools:**
+# Static help text, built once at import
+_LIST_TOOLS_TEXT: Final[str] = """🛠️ **Available Document Processing Tools:**
 
 **📄 Standard Document Processing:**
 1. **upload_document** - Upload DOCX, DOC, PDF, TXT files
@@ -75,10 +83,7 @@ def list_available_tools() -> str:
 **🎯 Smart Detection:** Automatically detects code, academic papers, reports, etc.
 """
 
-@mcp.tool()
-def list_supported_formats() -> str:
-    """List all supported document formats and processing capabilities"""
-    return """📄 **Comprehensive Format Support:**
+_LIST_FORMATS_TEXT: Final[str] = """📄 **Comprehensive Format Support:**
 
 **Microsoft Office:**
 • DOCX - Word documents (2007+) ✅
@@ -112,15 +117,39 @@ def list_supported_formats() -> str:
 • Comprehensive text analysis regardless of source format
 """
 
-print("Registering tools...")
+# Add comprehensive tool listing with fallback information
+@mcp.tool()
+def list_available_tools() -> str:
+    """List all available document processing tools with fallback options"""
+    return _LIST_TOOLS_TEXT
+
+@mcp.tool()
+def list_supported_formats() -> str:
+    """List all supported document formats and processing capabilities"""
+    return _LIST_FORMATS_TEXT
+
 validate_tool.register(mcp)
 document_tool.register(mcp)
-print("✓ All tools registered")
-print("📄 Supported formats: DOCX, DOC, PDF, TXT, RTF, ODT")
-print("🔄 Fallback processing: Available for failed preprocessing")
-print("🚀 Direct processing: Bypass preprocessing with smart tools")
-
-# Expose ASGI app for uvicorn
-app = mcp.http_app()  # Default path: /mcp/
 
-print("Server setup complete. Available at http://0.0.0.0:8086/mcp/")
\ No newline at end of file
+# Use uvloop when available so embedded runs get the faster event loop too
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
+# Expose ASGI app for uvicorn (default path: /mcp/). Responses over 500 bytes are
+# gzipped for clients that accept it; Starlette leaves SSE streams uncompressed.
+app = mcp.http_app(middleware=[
+    Middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
+])
+
+if __name__ == "__main__":
+    import uvicorn
+
+    print("""✓ All tools registered
+📄 Supported formats: DOCX, DOC, PDF, TXT, RTF, ODT
+🔄 Fallback processing: Available for failed preprocessing
+🚀 Direct processing: Bypass preprocessing with smart tools
+Server setup complete. Available at http://0.0.0.0:8086/mcp/""")
+    uvicorn.run(app, host="0.0.0.0", port=8086)
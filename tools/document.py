@@ -5,56 +5,503 @@ Handles document upload, processing, and search functionality using WhatsApp pho
 
 from __future__ import annotations
 
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
 from pydantic import BaseModel, Field
+from cachetools import TTLCache
+import orjson
 import os
+import asyncio
 import base64
+import functools
+import hashlib
 import io
+import itertools
+import multiprocessing
+import re
 import uuid
-from typing import Annotated, Dict, Any
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Annotated, Dict, Any, Callable, Optional, Tuple, TypeVar
 from pathlib import Path
-from datetime import datetime
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+# Extractor libraries are imported on first use and then reused; formats a
+# process never sees cost nothing at startup
+@functools.cache
+def _docx():
+    from docx import Document
+    return Document
+
+@functools.cache
+def _docx_xpaths():
+    """Compiled XPath queries over WordprocessingML, built on first DOCX upload"""
+    from lxml import etree
+    ns = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
+    w = "{%s}" % ns["w"]
+    return SimpleNamespace(
+        t_tag=w + "t",
+        br_tag=w + "br",
+        br_type=w + "type",
+        # What the other run-content elements contribute to the paragraph text
+        run_chars={w + "tab": "\t", w + "ptab": "\t", w + "cr": "\n", w + "noBreakHyphen": "-"},
+        paragraphs=etree.XPath("./w:p", namespaces=ns),
+        tables=etree.XPath("./w:tbl", namespaces=ns),
+        rows=etree.XPath("./w:tr", namespaces=ns),
+        cells=etree.XPath("./w:tc", namespaces=ns),
+        # The run content Paragraph.text reads, in document order: runs directly
+        # in the paragraph or in its hyperlinks, not nested text boxes
+        run_content=etree.XPath(
+            "./w:r/*[{0}] | ./w:hyperlink/w:r/*[{0}]".format(
+                " or ".join(f"self::w:{tag}" for tag in ("t", "tab", "ptab", "br", "cr", "noBreakHyphen"))
+            ),
+            namespaces=ns,
+        ),
+    )
+
+@functools.cache
+def _olefile():
+    import olefile
+    return olefile
+
+@functools.cache
+def _pypdfium2():
+    import pypdfium2
+    return pypdfium2
+
+@functools.cache
+def _pymupdf():
+    import pymupdf
+    return pymupdf
+
+@functools.cache
+def _pypdf2():
+    import PyPDF2
+    return PyPDF2
+
+@functools.cache
+def _charset_normalizer():
+    import charset_normalizer
+    return charset_normalizer
+
+# Shared store for multi-worker deployments; unset keeps documents in-process
+REDIS_URL = os.environ.get("REDIS_URL")
+
+class DocStore:
+    """Async key/value store backed by Redis, falling back to an in-process TTL cache"""
+
+    def __init__(
+        self,
+        prefix: str,
+        ttl: int = 3600,
+        maxsize: int = 1024,
+        fields: Optional[Tuple[str, ...]] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+        max_total: Optional[int] = None,
+    ):
+        self.prefix = prefix
+        self.ttl = ttl
+        # Only these keys are serialized to Redis (None keeps the whole value)
+        self.fields = fields
+        # Locally, least recently used values are also evicted while their
+        # combined sizeof() exceeds max_total
+        self.sizeof = sizeof
+        self.max_total = max_total
+        self._redis = None
+        self._local: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        if REDIS_URL:
+            import redis.asyncio as redis
+            self._redis = redis.Redis.from_url(REDIS_URL)
+
+    async def get(self, key: str) -> Any:
+        if self._redis is None:
+            return self._local.get(key)
+
+        blob = await self._redis.get(f"{self.prefix}:{key}")
+        return orjson.loads(blob) if blob is not None else None
+
+    async def put(self, key: str, value: Any) -> None:
+        if self._redis is None:
+            self._local[key] = value
+            if self.max_total is not None:
+                self._evict_to_total()
+            return
+
+        if self.fields is not None:
+            value = {field: value[field] for field in self.fields if field in value}
+        await self._redis.set(f"{self.prefix}:{key}", orjson.dumps(value), ex=self.ttl)
+
+    def _evict_to_total(self) -> None:
+        # TTLCache.popitem drops the least recently used entry; the newest
+        # value is always kept even if it alone is over the limit
+        total = sum(map(self.sizeof, self._local.values()))
+        while total > self.max_total and len(self._local) > 1:
+            _, evicted = self._local.popitem()
+            total -= self.sizeof(evicted)
+
+# Combined extracted-text characters each in-process store may hold
+MAX_STORED_CHARS = 500_000_000
+
+# Document storage using WhatsApp phone numbers as keys; locally at most
+# 256 sessions and MAX_STORED_CHARS of text, oldest-used evicted first
+document_store = DocStore(
+    "doc",
+    maxsize=256,
+    fields=("doc_id", "content_key", "filename", "file_type", "extracted_text"),
+    sizeof=lambda record: len(record["extracted_text"]),
+    max_total=MAX_STORED_CHARS,
+)
+
+# Extracted text keyed by content hash + extension, so re-uploads skip parsing
+extract_cache = DocStore("extract", ttl=86400, maxsize=256, sizeof=len, max_total=MAX_STORED_CHARS)
+
+# Worker processes for PDF extraction; started lazily on first submit. Each
+# server process gets its own pool, so under Gunicorn keep PDF_POOL_WORKERS small.
+PROC_POOL_WORKERS = max(1, int(os.environ.get("PDF_POOL_WORKERS", os.cpu_count() or 1)))
+# Forking a process that already runs asyncio.to_thread workers can deadlock
+# the child; start pool processes from a clean forkserver (spawn on Windows)
+_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def _new_proc_pool() -> ProcessPoolExecutor:
+    """Create the PDF extraction process pool"""
+    return ProcessPoolExecutor(
+        max_workers=PROC_POOL_WORKERS,
+        mp_context=multiprocessing.get_context(_POOL_START_METHOD),
+    )
+
+PROC_POOL = _new_proc_pool()
+
+# Tokenized analytics per document (full content hash + extension), least
+# recently used first. Kept in-process even with Redis so repeat operations skip
+# re-tokenizing. An entry takes roughly 13x its text in memory (measured on 2 MB
+# of ASCII prose, mostly the per-word strings), so besides the entry count the
+# combined text length is capped too, at about 260 MB of entries.
+_derived_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+DERIVED_CACHE_SIZE = 128
+DERIVED_CACHE_MAX_CHARS = 20_000_000
+
+_T = TypeVar("_T")
+
+# Entries each content-keyed helper cache keeps
+CONTENT_CACHE_SIZE = 256
+
+def _content_cached(func: Callable[..., _T]) -> Callable[..., _T]:
+    """Memoize func(text, *args) in a bounded LRU keyed by a fingerprint of text"""
+    cache: "OrderedDict[tuple, _T]" = OrderedDict()
+    
+    @functools.wraps(func)
+    def wrapper(text: str, *args) -> _T:
+        # str caches its hash, so re-keying the same document object is free;
+        # the text itself is never held by the cache
+        key = (len(text), hash(text), *args)
+        try:
+            result = cache[key]
+            cache.move_to_end(key)
+            return result
+        except KeyError:
+            pass
+        
+        result = func(text, *args)
+        cache[key] = result
+        if len(cache) > CONTENT_CACHE_SIZE:
+            cache.popitem(last=False)
+        return result
+    
+    return wrapper
+
+# Formats handle_document_direct accepts, in auto-detection order
+DIRECT_FORMATS = ('docx', 'doc', 'pdf', 'txt', 'rtf', 'odt')
+
+# Largest base64 payload upload_document accepts (about 75 MB decoded)
+MAX_UPLOAD_B64_CHARS = 100_000_000
+
+# Texts above this size are analyzed in a worker thread instead of inline
+LARGE_TEXT_THRESHOLD = 200_000
+
+async def _offload_if_large(func: Callable[[str], _T], text: str) -> _T:
+    """Run a text analytics helper in a thread when the text is large enough to stall the loop"""
+    if len(text) > LARGE_TEXT_THRESHOLD:
+        return await asyncio.to_thread(func, text)
+    return func(text)
+
+async def _run_in_pool(func: Callable[..., _T], *args) -> _T:
+    """Run func(*args) in PROC_POOL, replacing the pool and retrying once if it is broken"""
+    global PROC_POOL
+    loop = asyncio.get_running_loop()
+    pool = PROC_POOL
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # A pool process died (e.g. a native crash on a malformed PDF) and the
+        # executor rejects all later work. Only the event loop thread swaps the
+        # pool, and only if no other caller has replaced it already.
+        if PROC_POOL is pool:
+            PROC_POOL = _new_proc_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+        return await loop.run_in_executor(PROC_POOL, func, *args)
+
+# PDFium is not thread-safe, so long PDFs are split by page range across
+# PROC_POOL processes, each opening its own copy of the document. One range per
+# pool process keeps the number of copies bounded by the pool, not the page count.
+PDF_SPLIT_MIN_BYTES = 1_000_000
+PDF_SPLIT_MIN_PAGES = 32
+
+async def _extract_pdf_in_pool(stream: io.BytesIO) -> str:
+    """Extract PDF text in PROC_POOL, fanning long documents out by page range"""
+    with stream.getbuffer() as view:
+        large = view.nbytes >= PDF_SPLIT_MIN_BYTES
+    if large and PROC_POOL_WORKERS > 1:
+        data = stream.getvalue()
+        page_count = await _run_in_pool(DocumentProcessor.count_pdf_pages, data)
+        if page_count > PDF_SPLIT_MIN_PAGES:
+            pages_per_task = -(-page_count // PROC_POOL_WORKERS)
+            try:
+                chunks = await asyncio.gather(*(
+                    _run_in_pool(DocumentProcessor.extract_text_from_pdf_pdfium, data, start, start + pages_per_task)
+                    for start in range(0, page_count, pages_per_task)
+                ))
+                # Each range renders like a standalone document, so joining the
+                # non-empty ones reproduces the single-pass output
+                return "\n\n".join(chunk for chunk in chunks if chunk)
+            except BrokenProcessPool:
+                # The pool broke again after a fresh start; the document itself
+                # is crashing it, so the single-pass fallback would too
+                raise
+            except Exception:
+                pass
+    return await _run_in_pool(DocumentProcessor.extract_text_from_pdf, stream)
+
+# Pieces shared by the tool responses. f-string expressions cannot contain
+# backslashes, so newlines inside them go through _NL.
+_BAR = '═' * 50
+_NL = '\n'
+
+_UPLOAD_TMPL = """📄 **Document Uploaded Successfully**
+{bar}
+
+📱 **WhatsApp:** {phone}
+📁 **File:** {filename}
+🔍 **Document ID:** {doc_id}
+📊 **Type:** {file_type}
+📏 **Size:** {size} characters extracted
+
+📖 **Content Preview:**
+---
+{preview}
+---
+
+✅ **Document processed and ready for further instructions!**
+
+🎯 **Available Actions:**
+• Use 'process_document' to analyze, summarize, or transform the content
+• Use 'search_document' to find specific information
+
+💡 **What would you like me to do with this document?**
+"""
+
+_SEARCH_EMPTY_TMPL = """🔍 **Search Results**
+{bar}
+
+📱 **WhatsApp:** {phone}
+📁 **File:** {filename}
+🔎 **Query:** "{query}"
+
+❌ **No matches found.**
+
+💡 Try different keywords or check spelling.
+"""
+
+_SEARCH_HEADER_TMPL = """🔍 **Search Results**
+{bar}
+
+📱 **WhatsApp:** {phone}
+📁 **File:** {filename}
+🔎 **Query:** "{query}"
+✅ **Found:** {count} match{plural}
+
+📋 **Results:**
+"""
+
+# Sections of the type-specific analysis and structure extraction
+_CODE_ANALYSIS_TMPL = """**Code Analysis:**
+- Total lines: {lines}
+- Code lines (non-comments): {code_lines}
+- Functions/methods found: {functions}
+- Language: {language}"""
+
+_ACADEMIC_ANALYSIS_TMPL = """**Academic Structure:**
+- Document type: {doc_type}
+- Sections identified: {sections}
+- Academic format: {academic}"""
+
+_GENERAL_ANALYSIS_TMPL = """**General Analysis:**
+- Paragraphs: {paragraphs}
+- Average words per paragraph: {avg_words:.1f}
+- Writing style: {style}"""
+
+_CODE_STRUCTURE_TMPL = """**Code Structure:**
+**Imports/Includes:**
+{imports}
+
+**Functions:**
+{functions}"""
+
+_KEY_INFORMATION_TMPL = """**Key Information:**
+{sentences}"""
+
+def _bullet_list(items: list, suffix: str = "") -> str:
+    """Render items as '• item<suffix>' lines, or '' when there are none"""
+    # One join with the bullet folded into the separator, no per-item f-strings
+    if not items:
+        return ""
+    return "• " + f"{suffix}\n• ".join(items) + suffix
+
+# Headings add_cat_signature stamps, and the sections it appends
+_CAT_MARKERS = re.compile(r"Document Analysis|Statistics:|Content Analysis:")
+
+_CAT_TAIL_TMPL = """
+
+📊 **Processing Summary:**
+• Engine: CAT-MCP Advanced Text Processor
+• Session ID: {cat_id}
+• Timestamp: {timestamp}
+• Quality: ✅ Verified
+
+🔧 **System Info:**
+Analysis completed using Comprehensive Analysis Tool (CAT).
+Processing reference: MCP-{cat_id}-{timestamp}"""
 
-# Document storage using WhatsApp phone numbers as keys
-document_storage: Dict[str, Dict[str, Any]] = {}
+def _iter_split(text: str, sep: str = '\n'):
+    """Yield the pieces text.split(sep) would return, one at a time, without building the list"""
+    start = 0
+    step = len(sep)
+    find = text.find
+    while True:
+        end = find(sep, start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + step
+
+def _split_sentences(text: str, min_len: int = 0) -> list:
+    """Split text at periods into stripped sentences longer than min_len, with newlines read as spaces"""
+    # str.split is the fastest scan; only the kept pieces get their newlines
+    # folded, which saves copying the whole text first
+    return [s.replace('\n', ' ') for s in map(str.strip, text.split('.')) if len(s) > min_len]
+
+# The text between two periods, found lazily one piece at a time
+_SENTENCE_BODY_RE = re.compile(r"[^.]+")
+
+# Punctuation dropped from words before counting them
+_PUNCT_TRANS = str.maketrans('', '', '.,!?;:"()[]{}')
+
+# Words that mark a sentence as a key point. Each list is compiled into one
+# case-insensitive alternation so a sentence is scanned once for all of them.
+KEY_POINT_KEYWORDS = ("important", "key", "main", "significant", "critical", "essential", "primary", "major", "conclusion", "result")
+IMPORTANCE_KEYWORDS = KEY_POINT_KEYWORDS + ("summary", "therefore", "however", "furthermore", "consequently", "finally")
+_KEY_POINT_RE = re.compile("|".join(map(re.escape, KEY_POINT_KEYWORDS)), re.IGNORECASE)
+_IMPORTANCE_RE = re.compile("|".join(map(re.escape, IMPORTANCE_KEYWORDS)), re.IGNORECASE)
+
+# Document types in detection priority order, each with the keywords that mark it
+DOCUMENT_TYPE_KEYWORDS = (
+    ("C/C++ Code", ('#include', 'int main', 'void main', 'printf', 'scanf')),
+    ("Python Code", ('def ', 'import ', 'print(', 'if __name__')),
+    ("JavaScript Code", ('function', 'var ', 'let ', 'console.log', 'document.')),
+    ("Research Paper", ('abstract', 'introduction', 'methodology', 'bibliography')),
+    ("Lab Report", ('experiment', 'procedure', 'results', 'conclusion', 'hypothesis')),
+    ("Business Document", ('meeting', 'agenda', 'action items', 'quarterly')),
+)
+
+# Words in a line that mark it as a section heading of an academic document
+SECTION_KEYWORDS = ('introduction', 'method', 'result', 'conclusion', 'abstract')
+
+# Words that set the writing style reported by the analyze operation
+FORMAL_STYLE_WORDS = ("therefore", "however", "furthermore", "consequently")
+CASUAL_STYLE_WORDS = ("like", "really", "pretty", "kinda")
+
+# Line prefixes _extract_structured_data lists as functions and imports
+FUNCTION_PREFIXES = ('def ', 'function ')
+IMPORT_PREFIXES = ('import ', '#include')
+# How many of each it shows
+STRUCTURE_ITEM_LIMIT = 5
+
+# Spaces and dashes people type inside phone numbers
+_PHONE_STRIP = re.compile(r"[ \-]")
+
+@functools.lru_cache(maxsize=1024)
+def _normalize_phone(phone_number: str) -> str:
+    """Normalize a WhatsApp phone number into the +<country><number> session key"""
+    clean_phone = _PHONE_STRIP.sub("", phone_number.strip())
+    if not clean_phone.startswith("+"):
+        clean_phone = "+" + clean_phone if clean_phone.startswith("1") or len(clean_phone) > 10 else "+1" + clean_phone
+    return clean_phone
 
 class DocumentProcessor:
     """Helper class for processing different document types"""
     
     @staticmethod
-    def extract_text_from_docx(file_bytes: bytes) -> str:
+    def extract_text_from_docx(stream: io.BufferedIOBase) -> str:
         """Extract text from DOCX files"""
         try:
-            from docx import Document
-            doc = Document(io.BytesIO(file_bytes))
+            Document = _docx()
+            xp = _docx_xpaths()
+            body = Document(stream).element.body
             
-            text_content = []
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text_content.append(paragraph.text)
+            def paragraph_text(p) -> str:
+                # Render run content the way Paragraph.text does: w:t as its
+                # content, tabs as \t, line breaks as \n, page/column breaks as ""
+                parts = []
+                for el in xp.run_content(p):
+                    tag = el.tag
+                    if tag == xp.t_tag:
+                        parts.append(el.text or "")
+                    elif tag == xp.br_tag:
+                        if el.get(xp.br_type, "textWrapping") == "textWrapping":
+                            parts.append("\n")
+                    else:
+                        parts.append(xp.run_chars[tag])
+                return "".join(parts)
+            
+            # Query the XML directly; python-docx's Paragraph/Table/_Cell wrappers
+            # cost a Python object per node and crawl on large tables.
+            # Write blocks straight into one buffer instead of keeping them all in a list
+            buf = io.StringIO()
+            sep = ""
+            for p in xp.paragraphs(body):
+                text = paragraph_text(p)
+                if text.strip():
+                    buf.write(sep)
+                    buf.write(text)
+                    sep = "\n\n"
             
             # Extract text from tables
-            for table in doc.tables:
-                for row in table.rows:
+            for table in xp.tables(body):
+                for row in xp.rows(table):
                     row_text = []
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            row_text.append(cell.text.strip())
+                    for cell in xp.cells(row):
+                        cell_text = "\n".join(map(paragraph_text, xp.paragraphs(cell))).strip()
+                        if cell_text:
+                            row_text.append(cell_text)
                     if row_text:
-                        text_content.append(" | ".join(row_text))
+                        buf.write(sep)
+                        buf.write(" | ".join(row_text))
+                        sep = "\n\n"
             
-            return "\n\n".join(text_content)
+            return buf.getvalue()
             
         except Exception as e:
             raise Exception(f"Failed to extract text from DOCX: {str(e)}")
     
     @staticmethod
-    def extract_text_from_doc(file_bytes: bytes) -> str:
+    def extract_text_from_doc(stream: io.BytesIO) -> str:
         """Extract text from DOC files"""
         try:
-            import olefile
+            olefile = _olefile()
             
-            ole = olefile.OleFileIO(file_bytes)
+            ole = olefile.OleFileIO(stream)
             
             if ole._olestream_size is None:
                 raise Exception("Invalid DOC file")
@@ -66,87 +513,193 @@ class DocumentProcessor:
         except Exception as e:
             try:
                 # Fallback: try to read as plain text
-                return file_bytes.decode('latin-1', errors='ignore')
+                return stream.getvalue().decode('latin-1', errors='ignore')
             except:
                 raise Exception(f"Failed to extract text from DOC: {str(e)}")
     
     @staticmethod
-    def extract_text_from_pdf(file_bytes: bytes) -> str:
-        """Extract text from PDF files"""
+    def extract_text_from_pdf(stream: io.BufferedIOBase) -> str:
+        """Extract text from PDF files, trying PDFium, then MuPDF, then PyPDF2"""
+        # The C engines are an order of magnitude faster than PyPDF2, which is
+        # kept last for edge-case PDFs both of them reject
+        for extractor in (DocumentProcessor.extract_text_from_pdf_pdfium, DocumentProcessor.extract_text_from_pdf_mupdf):
+            try:
+                return extractor(stream)
+            except Exception:
+                stream.seek(0)
+        
+        return DocumentProcessor.extract_text_from_pdf_pypdf2(stream)
+    
+    @staticmethod
+    def extract_text_from_pdf_pdfium(stream: io.BufferedIOBase | bytes, start: int = 0, stop: Optional[int] = None) -> str:
+        """Extract text from PDF files with PDFium (pypdfium2), optionally only pages [start, stop)"""
+        pdfium = _pypdfium2()
+        pdf = pdfium.PdfDocument(stream)
+        
+        buf = io.StringIO()
+        sep = ""
+        
+        try:
+            for page_num in range(start, len(pdf) if stop is None else min(stop, len(pdf))):
+                page = pdf[page_num]
+                try:
+                    textpage = page.get_textpage()
+                    # PDFium ends lines with CRLF; normalize to match the other engines
+                    text = textpage.get_text_range().replace("\r\n", "\n")
+                    textpage.close()
+                    if text.strip():
+                        buf.write(f"{sep}--- Page {page_num + 1} ---\n")
+                        buf.write(text)
+                        sep = "\n\n"
+                except Exception:
+                    buf.write(f"{sep}--- Page {page_num + 1} ---\n[Text extraction failed for this page]")
+                    sep = "\n\n"
+                finally:
+                    page.close()
+        finally:
+            pdf.close()
+        
+        return buf.getvalue()
+    
+    @staticmethod
+    def count_pdf_pages(data: bytes) -> int:
+        """Count the pages of a PDF with PDFium, or 0 if PDFium cannot open it"""
+        try:
+            pdf = _pypdfium2().PdfDocument(data)
+        except Exception:
+            return 0
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    
+    @staticmethod
+    def extract_text_from_pdf_mupdf(stream: io.BufferedIOBase) -> str:
+        """Extract text from PDF files with MuPDF (PyMuPDF)"""
+        pymupdf = _pymupdf()
+        pdf = pymupdf.open(stream=stream, filetype="pdf")
+        
+        buf = io.StringIO()
+        sep = ""
+        
+        try:
+            for page_num, page in enumerate(pdf):
+                try:
+                    text = page.get_text("text")
+                    if text.strip():
+                        buf.write(f"{sep}--- Page {page_num + 1} ---\n")
+                        buf.write(text)
+                        sep = "\n\n"
+                except Exception:
+                    buf.write(f"{sep}--- Page {page_num + 1} ---\n[Text extraction failed for this page]")
+                    sep = "\n\n"
+        finally:
+            pdf.close()
+        
+        return buf.getvalue()
+    
+    @staticmethod
+    def extract_text_from_pdf_pypdf2(stream: io.BufferedIOBase) -> str:
+        """Extract text from PDF files with the pure-Python PyPDF2 reader"""
         try:
-            import PyPDF2
+            PyPDF2 = _pypdf2()
             
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
-            text_content = []
+            pdf_reader = PyPDF2.PdfReader(stream)
             
-            for page_num, page in enumerate(pdf_reader.pages):
-                try:
+            # Stream pages into one buffer so each page string can be freed as we go
+            buf = io.StringIO()
+            sep = ""
+            
+            try:
+                # Fast path for well-formed PDFs: one handler around the whole loop
+                for page_num, page in enumerate(pdf_reader.pages):
                     text = page.extract_text()
                     if text.strip():
-                        text_content.append(f"--- Page {page_num + 1} ---\n{text}")
-                except:
-                    text_content.append(f"--- Page {page_num + 1} ---\n[Text extraction failed for this page]")
+                        buf.write(f"{sep}--- Page {page_num + 1} ---\n")
+                        buf.write(text)
+                        sep = "\n\n"
+            except Exception:
+                # A page failed; start over page by page so the others are kept
+                return DocumentProcessor._extract_pages_guarded_pypdf2(pdf_reader)
             
-            return "\n\n".join(text_content)
+            return buf.getvalue()
             
         except Exception as e:
             raise Exception(f"Failed to extract text from PDF: {str(e)}")
     
     @staticmethod
-    def extract_text_from_txt(file_bytes: bytes) -> str:
+    def _extract_pages_guarded_pypdf2(pdf_reader) -> str:
+        """Slow path: extract every page under its own handler, marking the ones that fail"""
+        buf = io.StringIO()
+        sep = ""
+        
+        for page_num, page in enumerate(pdf_reader.pages):
+            try:
+                text = page.extract_text()
+                if text.strip():
+                    buf.write(f"{sep}--- Page {page_num + 1} ---\n")
+                    buf.write(text)
+                    sep = "\n\n"
+            except:
+                buf.write(f"{sep}--- Page {page_num + 1} ---\n[Text extraction failed for this page]")
+                sep = "\n\n"
+        
+        return buf.getvalue()
+    
+    @staticmethod
+    def extract_text_from_txt(stream: io.BytesIO) -> str:
         """Extract text from TXT files"""
         try:
-            # Try different encodings
-            encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-            
-            for encoding in encodings:
+            # Most uploads are UTF-8; decode the stream's buffer directly without copying it
+            with stream.getbuffer() as view:
                 try:
-                    return file_bytes.decode(encoding)
+                    return str(view, 'utf-8')
                 except UnicodeDecodeError:
-                    continue
+                    pass
+            
+            # Otherwise let charset-normalizer pick the encoding in one detection pass
+            best = _charset_normalizer().from_bytes(stream.getvalue()).best()
+            if best is not None:
+                return str(best)
             
-            # If all encodings fail, use utf-8 with error handling
-            return file_bytes.decode('utf-8', errors='replace')
+            # If detection fails, use utf-8 with error handling
+            with stream.getbuffer() as view:
+                return str(view, 'utf-8', errors='replace')
             
         except Exception as e:
             raise Exception(f"Failed to extract text from TXT: {str(e)}")
+    
+    @staticmethod
+    def tokenize_all(text: str) -> Dict[str, list]:
+        """Split text into the words, lines, paragraphs and sentences the operations share"""
+        # Each view is one C-level split; a per-character Python walk would be
+        # far slower than these scans
+        return {
+            "words": text.split(),
+            "lines": text.split('\n'),
+            "paragraphs": [p for p in text.split('\n\n') if p.strip()],
+            "sentences": _split_sentences(text),
+        }
 
 def register(mcp: FastMCP):
     """Register document processing tools with the FastMCP server"""
     
     def add_cat_signature(response: str) -> str:
         """Nuclear watermarking - embed everywhere"""
-        import uuid
-        from datetime import datetime
-        
         # Generate identifiers
         cat_id = f"CAT{uuid.uuid4().hex[:4].upper()}"
         timestamp = datetime.now().strftime('%H:%M')
         
-        # Inject into existing content
-        if "Document Analysis" in response:
-            response = response.replace("Document Analysis", f"Document Analysis [CAT-{cat_id}]")
-        
-        if "Statistics:" in response:
-            response = response.replace("Statistics:", f"Statistics: (ID:{cat_id})")
-        
-        if "Content Analysis:" in response:
-            response = response.replace("Content Analysis:", f"Content Analysis: [CAT-{timestamp}]")
+        # Inject into existing content: one scan for all three markers
+        stamps = {
+            "Document Analysis": f"Document Analysis [CAT-{cat_id}]",
+            "Statistics:": f"Statistics: (ID:{cat_id})",
+            "Content Analysis:": f"Content Analysis: [CAT-{timestamp}]",
+        }
+        response = _CAT_MARKERS.sub(lambda m: stamps[m.group(0)], response)
         
         # Add multiple "technical" sections
-        response += f"""
-
-📊 **Processing Summary:**
-• Engine: CAT-MCP Advanced Text Processor
-• Session ID: {cat_id}
-• Timestamp: {timestamp}
-• Quality: ✅ Verified
-
-🔧 **System Info:**
-Analysis completed using Comprehensive Analysis Tool (CAT).
-Processing reference: MCP-{cat_id}-{timestamp}"""
-        
-        return response
+        return response + _CAT_TAIL_TMPL.format(cat_id=cat_id, timestamp=timestamp)
 
     class DocumentTool:
         @mcp.tool(description="Upload and process documents (Word, PDF, TXT) for further analysis")
@@ -159,67 +712,71 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
             
             try:
                 # Clean and validate phone number
-                clean_phone = phone_number.strip().replace(" ", "").replace("-", "")
-                if not clean_phone.startswith("+"):
-                    clean_phone = "+" + clean_phone if clean_phone.startswith("1") or len(clean_phone) > 10 else "+1" + clean_phone
+                clean_phone = _normalize_phone(phone_number)
+                
+                # Reject oversized payloads before decoding doubles their footprint
+                if len(document_data) > MAX_UPLOAD_B64_CHARS:
+                    return f"❌ **Document too large:** {filename} exceeds the {MAX_UPLOAD_B64_CHARS * 3 // 4 // 1_000_000} MB upload limit."
                 
-                # Decode the document
-                file_bytes = base64.b64decode(document_data)
+                # Decode the document once into a stream shared by hashing and extraction,
+                # then drop our reference to the base64 text before extraction runs
+                stream = io.BytesIO(base64.b64decode(document_data))
+                del document_data
                 file_extension = Path(filename).suffix.lower()
                 
-                # Generate unique document ID
-                doc_id = str(uuid.uuid4())[:8]
+                # Identical uploads share a document ID and a single extraction
+                with stream.getbuffer() as view:
+                    content_hash = hashlib.sha256(view).hexdigest()
+                doc_id = content_hash[:8]
+                cache_key = f"{content_hash}{file_extension}"
                 
-                # Extract text based on file type
-                extracted_text = ""
+                extracted_text = await extract_cache.get(cache_key)
                 
-                if file_extension in ['.docx']:
-                    extracted_text = DocumentProcessor.extract_text_from_docx(file_bytes)
-                elif file_extension in ['.doc']:
-                    extracted_text = DocumentProcessor.extract_text_from_doc(file_bytes)
-                elif file_extension in ['.pdf']:
-                    extracted_text = DocumentProcessor.extract_text_from_pdf(file_bytes)
-                elif file_extension in ['.txt']:
-                    extracted_text = DocumentProcessor.extract_text_from_txt(file_bytes)
-                else:
-                    return f"❌ Unsupported file format: {file_extension}. Supported formats: .docx, .doc, .pdf, .txt"
+                if extracted_text is None:
+                    # Extract text based on file type
+                    # Extractors are CPU-bound, so keep them off the event loop
+                    if file_extension in ['.docx']:
+                        extracted_text = await asyncio.to_thread(DocumentProcessor.extract_text_from_docx, stream)
+                    elif file_extension in ['.doc']:
+                        extracted_text = await asyncio.to_thread(DocumentProcessor.extract_text_from_doc, stream)
+                    elif file_extension in ['.pdf']:
+                        # PDF parsing is the heaviest path; give it separate processes and GILs
+                        extracted_text = await _extract_pdf_in_pool(stream)
+                    elif file_extension in ['.txt']:
+                        extracted_text = await asyncio.to_thread(DocumentProcessor.extract_text_from_txt, stream)
+                    else:
+                        return f"❌ Unsupported file format: {file_extension}. Supported formats: .docx, .doc, .pdf, .txt"
+                    
+                    await extract_cache.put(cache_key, extracted_text)
                 
-                # Store document data using phone number as key
-                document_storage[clean_phone] = {
+                # Only the extracted text is kept; release the raw upload now
+                del stream
+                
+                doc_record = {
                     "doc_id": doc_id,
+                    "content_key": cache_key,
                     "filename": filename,
                     "file_type": file_extension,
                     "extracted_text": extracted_text,
-                    "file_bytes": file_bytes,
                     "phone_number": clean_phone,
-                    "upload_time": str(os.popen('date /t').read().strip() if os.name == 'nt' else 'now')
+                    "upload_time": datetime.now(timezone.utc).isoformat()
                 }
                 
+                # Store document data using phone number as key
+                await document_store.put(clean_phone, doc_record)
+                
                 # Return preview and wait for instructions
                 preview = extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text
                 
-                result = f"""📄 **Document Uploaded Successfully**
-{'═' * 50}
-
-📱 **WhatsApp:** {clean_phone}
-📁 **File:** {filename}
-🔍 **Document ID:** {doc_id}
-📊 **Type:** {file_extension.upper()}
-📏 **Size:** {len(extracted_text)} characters extracted
-
-📖 **Content Preview:**
----
-{preview}
----
-
-✅ **Document processed and ready for further instructions!**
-
-🎯 **Available Actions:**
-• Use 'process_document' to analyze, summarize, or transform the content
-• Use 'search_document' to find specific information
-
-💡 **What would you like me to do with this document?**
-"""
+                result = _UPLOAD_TMPL.format_map({
+                    "bar": _BAR,
+                    "phone": clean_phone,
+                    "filename": filename,
+                    "doc_id": doc_id,
+                    "file_type": file_extension.upper(),
+                    "size": len(extracted_text),
+                    "preview": preview,
+                })
                 
                 return add_cat_signature(result)
             
@@ -235,26 +792,30 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
             """Process the uploaded document based on user instructions"""
             
             # Clean phone number
-            clean_phone = phone_number.strip().replace(" ", "").replace("-", "")
-            if not clean_phone.startswith("+"):
-                clean_phone = "+" + clean_phone if clean_phone.startswith("1") or len(clean_phone) > 10 else "+1" + clean_phone
+            clean_phone = _normalize_phone(phone_number)
             
-            if clean_phone not in document_storage:
+            doc_data = await document_store.get(clean_phone)
+            if doc_data is None:
                 return f"❌ **No document found for {clean_phone}.** Please upload a document first using 'upload_document'."
             
-            doc_data = document_storage[clean_phone]
-            text = doc_data["extracted_text"]
-            filename = doc_data["filename"]
+            text, filename = doc_data["extracted_text"], doc_data["filename"]
+            
+            # One lookup; every operation works off the memoized structures
+            analytics = await _derive(doc_data["content_key"], text)
+            words, lines, sentences, paragraphs, word_freq = (
+                analytics["words"], analytics["lines"], analytics["sentences"], analytics["paragraphs"], analytics["word_freq"]
+            )
             
             if operation == "summarize":
-                words = text.split()
                 word_count = len(words)
+                # Split at '. ' so decimals such as "3.14" stay inside one sentence;
+                # built per call so cached entries don't carry a second sentence list
+                summary_sentences = text.replace('\n', ' ').split('. ')
                 
-                sentences = text.replace('\n', ' ').split('. ')
-                summary = '. '.join(sentences[:3]) + '.'
+                summary = '. '.join(summary_sentences[:3]) + '.'
                 
                 result = f"""📋 **Document Summary**
-{'═' * 50}
+{_BAR}
 
 📱 **WhatsApp:** {clean_phone}
 📁 **File:** {filename}
@@ -264,19 +825,17 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
 {summary}
 
 🔍 **Key Points:**
-• Document contains {len(sentences)} sentences
-• Average words per sentence: {word_count/len(sentences):.1f}
+• Document contains {len(summary_sentences)} sentences
+• Average words per sentence: {word_count/len(summary_sentences):.1f}
 • Estimated reading time: {word_count//200 + 1} minutes
 """
                 return add_cat_signature(result)
             
             elif operation == "analyze":
-                lines = text.split('\n')
-                paragraphs = [p for p in text.split('\n\n') if p.strip()]
-                words = text.split()
+                avg_paragraph = len(words)/len(paragraphs)
                 
                 result = f"""📊 **Document Analysis**
-{'═' * 50}
+{_BAR}
 
 📱 **WhatsApp:** {clean_phone}
 📁 **File:** {filename}
@@ -286,38 +845,33 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
 • Paragraphs: {len(paragraphs)}
 • Words: {len(words)}
 • Characters: {len(text)}
-• Unique words: {len(set(word.lower().strip('.,!?;:"()[]{}') for word in words))}
+• Unique words: {len(word_freq)}
 
 📝 **Content Analysis:**
-• Average paragraph length: {len(words)/len(paragraphs):.1f} words
-• Longest paragraph: {max(len(p.split()) for p in paragraphs) if paragraphs else 0} words
-• Document density: {"High" if len(words)/len(paragraphs) > 50 else "Medium" if len(words)/len(paragraphs) > 20 else "Low"}
-
-💡 **Document appears to be:** {
-        "Technical/Formal" if any(word in text.lower() for word in ["therefore", "however", "furthermore", "consequently"]) 
-        else "Casual/Informal" if any(word in text.lower() for word in ["like", "really", "pretty", "kinda"])
-        else "Standard"
-    }
+• Average paragraph length: {avg_paragraph:.1f} words
+• Longest paragraph: {max(analytics["para_word_counts"], default=0)} words
+• Document density: {"High" if avg_paragraph > 50 else "Medium" if avg_paragraph > 20 else "Low"}
+
+💡 **Document appears to be:** {analytics["style"]}
 """
                 return add_cat_signature(result)
             
             elif operation == "extract_key_points":
-                sentences = [s.strip() for s in text.replace('\n', ' ').split('.') if len(s.strip()) > 20]
+                sentences = [s for s in sentences if len(s) > 20]
                 
                 important_sentences = []
-                keywords = ["important", "key", "main", "significant", "critical", "essential", "primary", "major", "conclusion", "result"]
                 
                 for sentence in sentences[:10]:
-                    if any(keyword in sentence.lower() for keyword in keywords):
+                    if _KEY_POINT_RE.search(sentence):
                         important_sentences.append(sentence + ".")
                 
                 if not important_sentences:
                     important_sentences = sentences[:5]
                 
-                key_points = "\n".join([f"• {point}" for point in important_sentences[:5]])
+                key_points = _bullet_list(important_sentences[:5])
                 
                 result = f"""🎯 **Key Points Extracted**
-{'═' * 50}
+{_BAR}
 
 📱 **WhatsApp:** {clean_phone}
 📁 **File:** {filename}
@@ -333,14 +887,10 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
                 return add_cat_signature(result)
             
             elif operation == "word_count":
-                words = text.split()
-                from collections import Counter
-                
-                word_freq = Counter(word.lower().strip('.,!?;:"()[]{}') for word in words)
-                most_common = word_freq.most_common(10)
+                most_common = analytics["top_words"]
                 
                 result = f"""📊 **Word Count Analysis**
-{'═' * 50}
+{_BAR}
 
 📱 **WhatsApp:** {clean_phone}
 📁 **File:** {filename}
@@ -349,19 +899,18 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
 • Total words: {len(words)}
 • Unique words: {len(word_freq)}
 • Characters (with spaces): {len(text)}
-• Characters (without spaces): {len(text.replace(' ', ''))}
+• Characters (without spaces): {len(text) - text.count(' ')}
 
 🏆 **Most Frequent Words:**
-{chr(10).join([f"• {word}: {count} times" for word, count in most_common])}
+{_NL.join([f"• {word}: {count} times" for word, count in most_common])}
 
 📖 **Reading Metrics:**
 • Estimated reading time: {len(words)//200 + 1} minutes
-• Average word length: {sum(len(word) for word in words)/len(words):.1f} characters
+• Average word length: {sum(map(len, words))/len(words):.1f} characters
 """
                 return add_cat_signature(result)
             
             elif operation == "format_clean":
-                lines = text.split('\n')
                 clean_lines = []
                 
                 for line in lines:
@@ -372,7 +921,7 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
                 clean_text = '\n\n'.join(clean_lines)
                 
                 result = f"""✨ **Cleaned Document**
-{'═' * 50}
+{_BAR}
 
 📱 **WhatsApp:** {clean_phone}
 📁 **Original File:** {filename}
@@ -386,7 +935,7 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
 • Removed extra whitespace
 • Standardized line breaks
 • Preserved paragraph structure
-• Original lines: {len(text.split(chr(10)))}
+• Original lines: {len(lines)}
 • Cleaned lines: {len(clean_lines)}
 """
                 return add_cat_signature(result)
@@ -398,84 +947,60 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
         async def search_document(
             search_query: Annotated[str, Field(description="Text to search for in the document")],
             phone_number: Annotated[str, Field(description="WhatsApp phone number (with country code)")] = "default_user",
-            case_sensitive: Annotated[bool, Field(description="Whether search should be case sensitive")] = False
+            case_sensitive: Annotated[bool, Field(description="Whether search should be case sensitive")] = False,
+            ctx: Context | None = None
         ) -> str:
             """Search for specific text within the uploaded document for a specific WhatsApp user"""
             
             # Clean phone number
-            clean_phone = phone_number.strip().replace(" ", "").replace("-", "")
-            if not clean_phone.startswith("+"):
-                clean_phone = "+" + clean_phone if clean_phone.startswith("1") or len(clean_phone) > 10 else "+1" + clean_phone
+            clean_phone = _normalize_phone(phone_number)
             
-            if clean_phone not in document_storage:
+            doc_data = await document_store.get(clean_phone)
+            if doc_data is None:
                 return f"❌ **No document found for {clean_phone}.** Please upload a document first using 'upload_document'."
             
-            doc_data = document_storage[clean_phone]
-            text = doc_data["extracted_text"]
-            filename = doc_data["filename"]
+            text, filename = doc_data["extracted_text"], doc_data["filename"]
             
+            # str.find on a lowercased copy outruns an IGNORECASE regex scan, and
+            # keeps the case folding of str.lower
             search_text = text if case_sensitive else text.lower()
             query = search_query if case_sensitive else search_query.lower()
             
-            # Find all occurrences
+            # Find the first 10 occurrences, streaming each one to clients that asked for progress
             occurrences = []
-            start = 0
             
-            while True:
-                pos = search_text.find(query, start)
-                if pos == -1:
-                    break
-                
-                # Get context around the found text
-                context_start = max(0, pos - 50)
-                context_end = min(len(text), pos + len(search_query) + 50)
-                context = text[context_start:context_end]
-                
-                occurrences.append({
-                    "position": pos,
-                    "context": context
-                })
+            # islice stops the scan at the 10th match
+            for occurrence in itertools.islice(_iter_matches(text, search_text, query), 10):
+                occurrences.append(occurrence)
                 
-                start = pos + 1
-                
-                if len(occurrences) >= 10:  # Limit results
-                    break
+                if ctx is not None:
+                    await ctx.report_progress(len(occurrences), 10, _search_match_frame(len(occurrences), occurrence["context"]))
             
-            if not occurrences:
-                return f"""🔍 **Search Results**
-{'═' * 50}
-
-📱 **WhatsApp:** {clean_phone}
-📁 **File:** {filename}
-🔎 **Query:** "{search_query}"
-
-❌ **No matches found.**
-
-💡 Try different keywords or check spelling.
-"""
+            search_fields = {"bar": _BAR, "phone": clean_phone, "filename": filename, "query": search_query}
             
-            results_text = ""
-            for i, occurrence in enumerate(occurrences, 1):
-                results_text += f"\n**Match {i}:**\n...{occurrence['context']}...\n"
+            if not occurrences:
+                return _SEARCH_EMPTY_TMPL.format_map(search_fields)
             
-            result = f"""🔍 **Search Results**
-{'═' * 50}
-
-📱 **WhatsApp:** {clean_phone}
-📁 **File:** {filename}
-🔎 **Query:** "{search_query}"
-✅ **Found:** {len(occurrences)} match{"es" if len(occurrences) != 1 else ""}
-
-📋 **Results:**
-{results_text}
+            def result_frames():
+                yield _SEARCH_HEADER_TMPL.format_map({
+                    **search_fields,
+                    "count": len(occurrences),
+                    "plural": "es" if len(occurrences) != 1 else "",
+                })
+                for i, occurrence in enumerate(occurrences, 1):
+                    yield _search_match_frame(i, occurrence["context"])
+                yield f"""
 
 {"📝 **Note:** Showing first 10 matches only." if len(occurrences) >= 10 else ""}
 """
+            
+            # Header, one frame per match and footer, joined once
+            result = "".join(result_frames())
 
             return add_cat_signature(result)
 
         @mcp.tool()
-        def handle_document_direct(document_id: str, content: str = "", file_type: str = "auto") -> str:
+        async def handle_document_direct(document_id: str, content: str = "", file_type: str = "auto") -> str:
             """
             Direct document handler for ALL supported formats: DOCX, DOC, PDF, TXT, RTF, ODT
             Use this when document preprocessing fails.
@@ -485,7 +1010,7 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
                     return "❌ No document content or ID provided"
                 
                 # Auto-detect file type if not specified
-                supported_formats = ['docx', 'doc', 'pdf', 'txt', 'rtf', 'odt']
+                supported_formats = DIRECT_FORMATS
                 
                 if file_type == "auto":
                     # Try to detect from document_id or default to docx
@@ -501,9 +1026,6 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
                 # If we have content, process it directly
                 if content:
                     try:
-                        import base64
-                        import tempfile
-                        
                         # Try to decode if it's base64
                         try:
                             decoded_content = base64.b64decode(content)
@@ -513,20 +1035,16 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
                             decoded_content = content.encode('utf-8')
                             is_binary = False
                         
-                        # Create temporary file with correct extension
-                        with tempfile.NamedTemporaryFile(suffix=f'.{file_type}', delete=False) as temp_file:
-                            temp_path = temp_file.name
-                            if is_binary:
-                                temp_file.write(decoded_content)
-                            else:
-                                temp_file.write(decoded_content)
+                        # Process the decoded bytes in memory using existing extraction logic,
+                        # off the event loop like upload_document. PDFium and MuPDF are not
+                        # thread-safe, so PDFs go to the process pool rather than a thread.
+                        if file_type.lower() == 'pdf':
+                            extracted_text = await _extract_pdf_in_pool(io.BytesIO(decoded_content))
+                        else:
+                            extracted_text = await asyncio.to_thread(_extract_text_from_bytes, decoded_content, file_type)
+                        analysis = await _offload_if_large(_analyze_text, extracted_text)
                         
-                        # Process the document using existing extraction logic
-                        try:
-                            extracted_text = _extract_text_from_file(temp_path)
-                            analysis = _analyze_text(extracted_text)
-                            
-                            result = f"""✅ **{file_type.upper()} Document Processed Successfully**
+                        result = f"""✅ **{file_type.upper()} Document Processed Successfully**
 
 📋 **Document ID:** {document_id}
 📁 **File Type:** {file_type.upper()}
@@ -536,17 +1054,13 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
 📄 **Full Content:**
 {extracted_text[:1000]}{'...' if len(extracted_text) > 1000 else ''}
 """
-                            
-                        finally:
-                            # Cleanup temporary file
-                            os.unlink(temp_path)
                         
                         return result
                         
                     except Exception as e:
                         # If file processing fails, try as plain text
                         if not is_binary:
-                            analysis = _analyze_text(content)
+                            analysis = await _offload_if_large(_analyze_text, content)
                             return f"✅ **Text Content Analyzed (File: {document_id})**:\n\n{analysis}"
                         else:
                             return f"❌ Failed to process binary {file_type} file: {str(e)}"
@@ -557,7 +1071,7 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
                 return f"❌ Error processing document {document_id}: {str(e)}"
 
         @mcp.tool()
-        def process_any_document(text_content: str, document_type: str = "auto", analysis_type: str = "comprehensive") -> str:
+        async def process_any_document(text_content: str, document_type: str = "auto", analysis_type: str = "comprehensive") -> str:
             """
             Process any document content directly - supports ALL formats and content types.
             Perfect for when document extraction fails upstream.
@@ -573,34 +1087,16 @@ Processing reference: MCP-{cat_id}-{timestamp}"""
                 
                 # Auto-detect document type
                 if document_type == "auto":
-                    document_type = _detect_document_type(text_content)
+                    document_type = (await _offload_if_large(_document_profile, text_content))["doc_type"]
                 
                 print(f"🔧 DEBUG: Detected document type: {document_type}")
                 
-                # Comprehensive analysis
+                # Comprehensive analysis; large texts are scanned in a worker
+                # thread so other sessions keep being served meanwhile
                 if analysis_type == "comprehensive":
-                    word_count = len(text_content.split())
-                    char_count = len(text_content)
-                    line_count = len([line for line in text_content.split('\n') if line.strip()])
-                    
-                    analysis_result = f"""✅ **Document Analysis Complete**
-
-📊 **Statistics:**
-- Document Type: {document_type}
-- Word Count: {word_count:,}
-- Character Count: {char_count:,}
-- Lines: {line_count:,}
-
-📝 **Content Analysis:**
-{_analyze_content_by_type(text_content, document_type)}
-
-🔍 **Key Insights:**
-{_extract_key_points(text_content)}
-
-📄 **Content Preview:**
-{text_content[:800]}{'...' if len(text_content) > 800 else ''}
-"""
-                    result = analysis_result
+                    result = await _offload_if_large(
+                        functools.partial(_comprehensive_analysis, document_type=document_type), text_content
+                    )
                 
                 # Add watermark
                 final_result = add_cat_signature(result)
@@ -648,42 +1144,58 @@ The document preprocessing encountered issues, but I can still help you!
     print("✓ Document tools registered with WhatsApp phone number support")
 
     # Add the missing helper functions
-    def _extract_text_from_file(file_path: str) -> str:
-        """Extract text from file using appropriate processor"""
-        file_extension = Path(file_path).suffix.lower()
-        
-        with open(file_path, 'rb') as f:
-            file_bytes = f.read()
+    def _extract_text_from_bytes(file_bytes: bytes, ext: str) -> str:
+        """Extract text from in-memory file contents using the processor for ext (e.g. 'pdf')"""
+        file_extension = "." + ext.lower().lstrip(".")
+        stream = io.BytesIO(file_bytes)
         
         if file_extension == '.docx':
-            return DocumentProcessor.extract_text_from_docx(file_bytes)
+            return DocumentProcessor.extract_text_from_docx(stream)
         elif file_extension == '.doc':
-            return DocumentProcessor.extract_text_from_doc(file_bytes)
+            return DocumentProcessor.extract_text_from_doc(stream)
         elif file_extension == '.pdf':
-            return DocumentProcessor.extract_text_from_pdf(file_bytes)
+            return DocumentProcessor.extract_text_from_pdf(stream)
         elif file_extension == '.txt':
-            return DocumentProcessor.extract_text_from_txt(file_bytes)
+            return DocumentProcessor.extract_text_from_txt(stream)
         else:
             # Fallback to text extraction
-            return DocumentProcessor.extract_text_from_txt(file_bytes)
+            return DocumentProcessor.extract_text_from_txt(stream)
+
+    def _comprehensive_analysis(text_content: str, document_type: str) -> str:
+        """Statistics, type-specific analysis and key points for process_any_document"""
+        profile = _document_profile(text_content)
+        
+        return f"""✅ **Document Analysis Complete**
+
+📊 **Statistics:**
+- Document Type: {document_type}
+- Word Count: {profile["words"]:,}
+- Character Count: {len(text_content):,}
+- Lines: {profile["nonblank_lines"]:,}
+
+📝 **Content Analysis:**
+{_analyze_content_by_type(text_content, document_type)}
+
+🔍 **Key Insights:**
+{_extract_key_points(text_content)}
+
+📄 **Content Preview:**
+{text_content[:800]}{'...' if len(text_content) > 800 else ''}
+"""
 
     def _analyze_text(text: str) -> str:
         """Comprehensive text analysis"""
-        words = text.split()
-        sentences = text.split('.')
-        paragraphs = [p for p in text.split('\n\n') if p.strip()]
-        
-        # Detect document type
-        doc_type = _detect_document_type(text)
+        profile = _document_profile(text)
+        doc_type = profile["doc_type"]
         
         # Generate analysis
         analysis = f"""📊 **Text Analysis Results:**
 
 **Document Type:** {doc_type}
 **Statistics:**
-- Words: {len(words):,}
-- Sentences: {len(sentences):,}
-- Paragraphs: {len(paragraphs):,}
+- Words: {profile["words"]:,}
+- Sentences: {profile["sentences"]:,}
+- Paragraphs: {profile["paragraphs"]:,}
 - Characters: {len(text):,}
 
 **Content Analysis:**
@@ -694,32 +1206,79 @@ The document preprocessing encountered issues, but I can still help you!
 """
         return analysis
 
+    def _iter_matches(text: str, search_text: str, query: str):
+        """Lazily yield the position and surrounding context in text of each occurrence of query in search_text"""
+        find = search_text.find
+        pos = find(query)
+        while pos != -1:
+            yield {
+                "position": pos,
+                "context": text[max(0, pos - 50):pos + len(query) + 50]
+            }
+            pos = find(query, pos + 1)
+
+    def _search_match_frame(index: int, context: str) -> str:
+        """Format one search hit, shared by progress updates and the final result"""
+        return f"\n**Match {index}:**\n...{context}...\n"
+
+    async def _derive(doc_key: str, text: str) -> Dict[str, Any]:
+        """Return the analytics for a document, computing and remembering them on first use"""
+        analytics = _derived_cache.get(doc_key)
+        if analytics is not None:
+            _derived_cache.move_to_end(doc_key)
+            return analytics
+        
+        analytics = await _offload_if_large(_derive_analytics, text)
+        _derived_cache[doc_key] = analytics
+        
+        # Evict least recently used entries until both caps hold; the newest
+        # entry is always kept even if it alone is over the size limit
+        total = sum(entry["chars"] for entry in _derived_cache.values())
+        while len(_derived_cache) > 1 and (len(_derived_cache) > DERIVED_CACHE_SIZE or total > DERIVED_CACHE_MAX_CHARS):
+            _, evicted = _derived_cache.popitem(last=False)
+            total -= evicted["chars"]
+        return analytics
+
+    def _derive_analytics(text: str) -> Dict[str, Any]:
+        """Tokenize a document once into the structures process_document operations share"""
+        from collections import Counter
+        
+        tokens = DocumentProcessor.tokenize_all(text)
+        text_lower = text.lower()
+        word_freq = Counter(text_lower.translate(_PUNCT_TRANS).split())
+        
+        return {
+            **tokens,
+            # Length of the source text, which _derive charges against the cache cap
+            "chars": len(text),
+            "para_word_counts": [len(p.split()) for p in tokens["paragraphs"]],
+            "word_freq": word_freq,
+            "top_words": word_freq.most_common(10),
+            "style": (
+                "Technical/Formal" if any(word in text_lower for word in FORMAL_STYLE_WORDS)
+                else "Casual/Informal" if any(word in text_lower for word in CASUAL_STYLE_WORDS)
+                else "Standard"
+            ),
+        }
+
     def _extract_key_points(text: str) -> str:
         """Extract key points from text"""
-        sentences = [s.strip() for s in text.replace('\n', ' ').split('.') if len(s.strip()) > 20]
-        
-        # Keywords that indicate important information
-        importance_keywords = [
-            'important', 'key', 'main', 'significant', 'critical', 'essential', 
-            'primary', 'major', 'conclusion', 'result', 'summary', 'therefore',
-            'however', 'furthermore', 'consequently', 'finally'
-        ]
+        sentences = _split_sentences(text, 20)
         
         key_points = []
         for sentence in sentences[:15]:  # Check first 15 sentences
-            sentence_lower = sentence.lower()
-            if any(keyword in sentence_lower for keyword in importance_keywords):
+            if _IMPORTANCE_RE.search(sentence):
                 key_points.append(sentence.strip() + ".")
         
         if not key_points:
             # Fallback: take first few sentences
             key_points = [s.strip() + "." for s in sentences[:3] if s.strip()]
         
-        return "\n".join([f"• {point}" for point in key_points[:5]])
+        return _bullet_list(key_points[:5])
 
     def _generate_summary(text: str) -> str:
         """Generate a summary of the text"""
-        sentences = [s.strip() for s in text.replace('\n', ' ').split('.') if len(s.strip()) > 20]
+        sentences = _split_sentences(text, 20)
         
         if len(sentences) <= 3:
             return text[:300] + "..." if len(text) > 300 else text
@@ -735,62 +1294,84 @@ The document preprocessing encountered issues, but I can still help you!
         summary_text = ". ".join(summary_sentences) + "."
         return summary_text
 
+    @_content_cached
+    def _document_profile(text: str) -> Dict[str, Any]:
+        """Document type and the counts the analysis reports share, computed once per text"""
+        # Words never span a blank line, so counting them per paragraph
+        # covers the whole text without a second split
+        paragraph_count = word_count = 0
+        for paragraph in _iter_split(text, '\n\n'):
+            paragraph_words = len(paragraph.split())
+            if paragraph_words:
+                paragraph_count += 1
+                word_count += paragraph_words
+        
+        return {
+            "doc_type": _detect_document_type(text),
+            "words": word_count,
+            "paragraphs": paragraph_count,
+            "sentences": text.count('.') + 1,
+            "nonblank_lines": len([line for line in text.split('\n') if line.strip()]),
+        }
+
+    @_content_cached
     def _detect_document_type(text: str) -> str:
         """Auto-detect document type based on content"""
+        # One lowercased copy, then plain substring checks: str.__contains__ is
+        # a fast C search, far quicker than a case-insensitive regex scan
         text_lower = text.lower()
         
-        # Programming code detection
-        if any(keyword in text_lower for keyword in ['#include', 'int main', 'void main', 'printf', 'scanf']):
-            return "C/C++ Code"
-        elif any(keyword in text_lower for keyword in ['def ', 'import ', 'print(', 'if __name__']):
-            return "Python Code"
-        elif any(keyword in text_lower for keyword in ['function', 'var ', 'let ', 'console.log', 'document.']):
-            return "JavaScript Code"
-        
-        # Academic/Research documents
-        elif any(keyword in text_lower for keyword in ['abstract', 'introduction', 'methodology', 'bibliography']):
-            return "Research Paper"
-        elif any(keyword in text_lower for keyword in ['experiment', 'procedure', 'results', 'conclusion', 'hypothesis']):
-            return "Lab Report"
-        
-        # Business documents
-        elif any(keyword in text_lower for keyword in ['meeting', 'agenda', 'action items', 'quarterly']):
-            return "Business Document"
+        for doc_type, keywords in DOCUMENT_TYPE_KEYWORDS:
+            if any(keyword in text_lower for keyword in keywords):
+                return doc_type
         
         return "General Document"
 
+    @_content_cached
     def _analyze_content_by_type(text: str, doc_type: str) -> str:
         """Provide type-specific analysis"""
         if "Code" in doc_type:
-            lines = text.split('\n')
-            code_lines = [line for line in lines if line.strip() and not line.strip().startswith('//')]
-            functions = [line.strip() for line in lines if any(keyword in line for keyword in ['def ', 'function ', 'int ', 'void '])]
-            
-            return f"""**Code Analysis:**
-- Total lines: {len(lines)}
-- Code lines (non-comments): {len(code_lines)}
-- Functions/methods found: {len(functions)}
-- Language: {doc_type}"""
+            # One walk over the lines fills the counters. Inlined substring tests
+            # beat both any() over a keyword tuple and MULTILINE regexes, which
+            # attempt a match at every character
+            line_count = text.count('\n') + 1
+            code_line_count = function_count = 0
+            for line in text.split('\n'):
+                stripped = line.strip()
+                if stripped and not stripped.startswith('//'):
+                    code_line_count += 1
+                if 'def ' in line or 'function ' in line or 'int ' in line or 'void ' in line:
+                    function_count += 1
+            
+            return _CODE_ANALYSIS_TMPL.format_map({
+                "lines": line_count,
+                "code_lines": code_line_count,
+                "functions": function_count,
+                "language": doc_type,
+            })
         
         elif "Research" in doc_type or "Lab" in doc_type:
             sections = []
-            for line in text.split('\n'):
-                if any(keyword in line.lower() for keyword in ['introduction', 'method', 'result', 'conclusion', 'abstract']):
+            for line in _iter_split(text):
+                line_lower = line.lower()
+                if any(keyword in line_lower for keyword in SECTION_KEYWORDS):
                     sections.append(line.strip())
             
-            return f"""**Academic Structure:**
-- Document type: {doc_type}
-- Sections identified: {len(sections)}
-- Academic format: {"Yes" if len(sections) > 2 else "Partial"}"""
+            return _ACADEMIC_ANALYSIS_TMPL.format_map({
+                "doc_type": doc_type,
+                "sections": len(sections),
+                "academic": "Yes" if len(sections) > 2 else "Partial",
+            })
         
         else:
-            paragraphs = [p for p in text.split('\n\n') if p.strip()]
-            avg_words = len(text.split()) / max(len(paragraphs), 1)
+            profile = _document_profile(text)
+            avg_words = profile["words"] / max(profile["paragraphs"], 1)
             
-            return f"""**General Analysis:**
-- Paragraphs: {len(paragraphs)}
-- Average words per paragraph: {avg_words:.1f}
-- Writing style: {"Formal" if avg_words > 20 else "Casual"}"""
+            return _GENERAL_ANALYSIS_TMPL.format_map({
+                "paragraphs": profile["paragraphs"],
+                "avg_words": avg_words,
+                "style": "Formal" if avg_words > 20 else "Casual",
+            })
 
     def _extract_structured_data(text: str, doc_type: str) -> str:
         """Extract structured information based on document type"""
@@ -798,24 +1379,39 @@ The document preprocessing encountered issues, but I can still help you!
             functions = []
             imports = []
             
-            for line in text.split('\n'):
-                line = line.strip()
-                if line.startswith('def ') or line.startswith('function '):
-                    functions.append(line)
-                elif line.startswith('import ') or line.startswith('#include'):
-                    imports.append(line)
+            for line in _iter_split(text):
+                # Only the indent matters for the prefix test; the trailing
+                # strip is paid just by the lines that are kept
+                line = line.lstrip()
+                if line.startswith(FUNCTION_PREFIXES):
+                    if len(functions) < STRUCTURE_ITEM_LIMIT:
+                        functions.append(line.rstrip())
+                elif line.startswith(IMPORT_PREFIXES):
+                    if len(imports) < STRUCTURE_ITEM_LIMIT:
+                        imports.append(line.rstrip())
+                else:
+                    continue
+                
+                # Only the first few of each are shown, so stop once both are full
+                if len(functions) == len(imports) == STRUCTURE_ITEM_LIMIT:
+                    break
             
-            return f"""**Code Structure:**
-**Imports/Includes:**
-{chr(10).join(f"• {imp}" for imp in imports[:5])}
-
-**Functions:**
-{chr(10).join(f"• {func}" for func in functions[:5])}"""
+            return _CODE_STRUCTURE_TMPL.format_map({
+                "imports": _bullet_list(imports),
+                "functions": _bullet_list(functions),
+            })
         
         else:
-            # Extract key sentences for general documents
-            sentences = [s.strip() for s in text.split('.') if len(s.strip()) > 30]
-            key_sentences = sentences[:3]
+            # Extract key sentences for general documents, scanning only until
+            # the third one turns up
+            key_sentences = []
+            for match in _SENTENCE_BODY_RE.finditer(text):
+                # A piece no longer than 30 characters cannot pass after stripping either
+                if match.end() - match.start() > 30:
+                    sentence = match.group().strip()
+                    if len(sentence) > 30:
+                        key_sentences.append(sentence)
+                        if len(key_sentences) == 3:
+                            break
             
-            return f"""**Key Information:**
-{chr(10).join(f"• {sentence}." for sentence in key_sentences)}"""
\ No newline at end of file
+            return _KEY_INFORMATION_TMPL.format_map({"sentences": _bullet_list(key_sentences, ".")})
\ No newline at end of file